@@ -6,6 +6,9 @@
 支持播放指定歌曲,返回音频URL和歌曲信息。
 """
 
+import sys
+from functools import partial
+
 from nekro_agent.api import message
 from nekro_agent.api.schemas import AgentCtx
 from nekro_agent.core import logger
@@ -13,14 +16,14 @@ from nekro_agent.services.plugin.base import ConfigBase, NekroPlugin, SandboxMet
 from pydantic import Field
 
 from .card_api import get_cover_url, get_signed_netease_card, get_song_play_url
-from .image_gen import generate_song_list_image
+from .http_client import close_http_client
 from .ncm_api import (
+    aget_song_detail,
+    asearch_songs_from_ncm,
     cleanup_pyncm_session,
     ensure_session_initialized,
-    get_song_detail,
-    search_songs_from_ncm,
 )
-from .utils import parse_chat_key
+from .utils import IMAGE_OUTPUT_DIR, parse_chat_key, remove_expired_files
 
 # --- Plugin Instance ---
 
@@ -120,14 +123,16 @@ async def search_songs(_ctx: AgentCtx, keyword: str) -> str:
         return error
 
     # 搜索歌曲
-    song_infos = search_songs_from_ncm(
+    song_infos = await asearch_songs_from_ncm(
         keyword=keyword,
         max_results=config.MAX_SEARCH_RESULTS,
         default_cover_url=config.DEFAULT_COVER_URL,
     )
 
-    # # 生成图片
-    # image_base64 = await generate_song_list_image(
+    # # 生成图片(按需导入, 避免插件加载时就引入 Pillow)
+    # from .image_gen import generate_song_list_image
+    #
+    # image_path = await generate_song_list_image(
     #     songs=song_infos,
     #     background_url=config.IMAGE_BACKGROUND_URL,
     #     font_path=config.FONT_PATH,
@@ -137,13 +142,8 @@ async def search_songs(_ctx: AgentCtx, keyword: str) -> str:
     # )
 
     # 构建响应
-    response = f"为您找到以下歌曲(关键词: {keyword}):\n\n"
-    for i, song in enumerate(song_infos):
-        response += f"{i+1}. {song.name} - {song.artist} (ID: {song.id})\n"
-
-    response += "\n若要播放,请使用 'play_song' 方法。"
-
-    return response
+    lines = [f"{i+1}. {song.name} - {song.artist} (ID: {song.id})" for i, song in enumerate(song_infos)]
+    return f"为您找到以下歌曲(关键词: {keyword}):\n\n" + "\n".join(lines) + "\n\n若要播放,请使用 'play_song' 方法。"
 
 
 @plugin.mount_sandbox_method(SandboxMethodType.TOOL, "播放歌曲")
@@ -162,7 +162,7 @@ async def play_song(_ctx: AgentCtx, song_id: int) -> str:
         return error
 
     # 获取歌曲详情
-    song_detail = get_song_detail(song_id)
+    song_detail = await aget_song_detail(song_id)
     song_name = song_detail["name"]
     artist_name = ", ".join([ar["name"] for ar in song_detail.get("ar", [])])
 
@@ -173,10 +173,14 @@ async def play_song(_ctx: AgentCtx, song_id: int) -> str:
 
     # OneBot v11: 发送网易云音乐卡片
     from nonebot import get_bot
-    from nonebot.adapters.onebot.v11 import ActionFailed, MessageSegment
+    from nonebot.adapters.onebot.v11 import ActionFailed, Message, MessageSegment
 
     bot = get_bot()
     chat_type, target_id = parse_chat_key(_ctx.chat_key)
+    if chat_type == "private":
+        send = partial(bot.call_api, "send_private_msg", user_id=target_id)
+    else:
+        send = partial(bot.call_api, "send_group_msg", group_id=target_id)
 
     # 获取播放链接和封面
     music_url = await get_song_play_url(song_id)
@@ -197,10 +201,7 @@ async def play_song(_ctx: AgentCtx, song_id: int) -> str:
         if json_payload:
             try:
                 json_msg = MessageSegment.json(json_payload)
-                if chat_type == "private":
-                    await bot.call_api("send_private_msg", user_id=target_id, message=json_msg)
-                else:
-                    await bot.call_api("send_group_msg", group_id=target_id, message=json_msg)
+                await send(message=json_msg)
                 card_sent = True
                 logger.info("JSON卡片发送成功")
             except ActionFailed as e:
@@ -209,28 +210,16 @@ async def play_song(_ctx: AgentCtx, song_id: int) -> str:
     if card_sent:
         return f"🎵 歌曲《{song_name}》卡片已发送"
 
-    # 降级方案：发送文字 + 封面 + 语音
-    message_text = f"{song_name} - {artist_name}"
-    if chat_type == "private":
-        await bot.call_api("send_private_msg", user_id=target_id, message=message_text)
-    else:
-        await bot.call_api("send_group_msg", group_id=target_id, message=message_text)
-
-    # 发送封面
+    # 降级方案：文字和封面合并为一条消息发送, 语音需单独发送
+    text_msg = Message(MessageSegment.text(f"{song_name} - {artist_name}"))
     if cover_url and config.COVER_SIZE > 0:
-        cover_msg = MessageSegment.image(cover_url)
-        if chat_type == "private":
-            await bot.call_api("send_private_msg", user_id=target_id, message=cover_msg)
-        else:
-            await bot.call_api("send_group_msg", group_id=target_id, message=cover_msg)
+        text_msg.append(MessageSegment.image(cover_url))
+    await send(message=text_msg)
 
     # 发送语音
     if music_url:
         voice_msg = MessageSegment.record(file=music_url)
-        if chat_type == "private":
-            await bot.call_api("send_private_msg", user_id=target_id, message=voice_msg)
-        else:
-            await bot.call_api("send_group_msg", group_id=target_id, message=voice_msg)
+        await send(message=voice_msg)
 
     return f"🎵 歌曲《{song_name}》已发送（文字+封面+语音）"
 
@@ -239,3 +228,10 @@ async def play_song(_ctx: AgentCtx, song_id: int) -> str:
 async def cleanup():
     """清理插件资源"""
     cleanup_pyncm_session()
+    await close_http_client()
+    remove_expired_files(IMAGE_OUTPUT_DIR, 0)
+
+    # image_gen 按需导入, 未加载过时没有模板缓存需要清理, 也不必为此引入 Pillow
+    image_gen = sys.modules.get(f"{__name__}.image_gen")
+    if image_gen is not None:
+        image_gen.clear_template_cache()
@@ -2,8 +2,11 @@
 
 from typing import Optional
 
-import httpx
 from nekro_agent.core import logger
+from pydantic import ValidationError
+
+from .http_client import get_http_client
+from .models import CardApiResponse
 
 
 async def get_song_play_url(song_id: int) -> str:
@@ -71,16 +74,19 @@ async def get_signed_netease_card(
         
         api_url = "https://oiapi.net/api/QQMusicJSONArk"
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            resp = await client.post(api_url, data=data)
-            if resp.status_code == 200:
-                resp_json = resp.json()
-                if resp_json.get("code") == 1 and resp_json.get("message"):
-                    logger.info("获取网易云音乐卡片成功")
-                    return resp_json["message"]
-                logger.warning(f"获取卡片失败: {resp_json}")
-            else:
-                logger.warning(f"卡片API请求失败: {resp.status_code}")
+        resp = await get_http_client().post(api_url, data=data, timeout=10.0)
+        if resp.status_code == 200:
+            resp_json = resp.json()
+            try:
+                card_resp = CardApiResponse.model_validate(resp_json)
+            except ValidationError:
+                card_resp = None
+            if card_resp and card_resp.code == 1 and card_resp.message:
+                logger.info("获取网易云音乐卡片成功")
+                return card_resp.message
+            logger.warning(f"获取卡片失败: {resp_json}")
+        else:
+            logger.warning(f"卡片API请求失败: {resp.status_code}")
     except Exception as e:
         logger.warning(f"获取卡片出错: {e}")
     
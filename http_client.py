@@ -0,0 +1,29 @@
+"""共享 HTTP 客户端"""
+
+from typing import Optional
+
+import httpx
+
+# 插件内所有 HTTP 请求共用一个客户端, 复用连接池, 避免每次请求重新握手
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """获取共享的 HTTP 客户端,已关闭时自动重建"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        # h2 随 nekro-agent 的 httpx[http2] 依赖一起安装, 封面与卡片请求可在同一连接上多路复用
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60),
+            timeout=httpx.Timeout(15.0, connect=3.0),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """关闭共享的 HTTP 客户端"""
+    global _http_client
+    if _http_client is not None and not _http_client.is_closed:
+        await _http_client.aclose()
+    _http_client = None
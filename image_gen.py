@@ -1,15 +1,180 @@
 """图片生成模块"""
 
+import asyncio
 import base64
+import hashlib
 import io
 import textwrap
-from typing import List
+import threading
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Optional, Tuple
 
 import httpx
 from nekro_agent.core import logger
 from PIL import Image, ImageDraw, ImageFont
 
+from .http_client import get_http_client
 from .models import SongInfo
+from .utils import IMAGE_OUTPUT_DIR, TEMP_DIR, TTLCache, remove_expired_files
+
+# 已缩放图片的缓存: 磁盘按 sha1(url)+尺寸 存 WebP, 内存保留最热的若干张
+CACHE_DIR = TEMP_DIR / "images"
+_MEMORY_CACHE_SIZE = 64
+_memory_cache: "OrderedDict[Tuple[str, Tuple[int, int]], Image.Image]" = OrderedDict()
+# 缓存读写在工作线程中执行, OrderedDict 的调整需要加锁
+_memory_cache_lock = threading.Lock()
+
+
+def _cache_path(url: str, size: tuple[int, int]) -> Path:
+    """计算图片缓存文件路径"""
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{digest}_{size[0]}x{size[1]}.webp"
+
+
+def _load_cached_image(url: str, size: tuple[int, int]) -> Optional[Image.Image]:
+    """从内存或磁盘缓存读取已缩放的图片,未命中返回None"""
+    key = (url, size)
+    with _memory_cache_lock:
+        img = _memory_cache.get(key)
+        if img is not None:
+            _memory_cache.move_to_end(key)
+            return img.copy()
+
+    cache_path = _cache_path(url, size)
+    if not cache_path.exists():
+        return None
+    try:
+        with Image.open(cache_path) as cached:
+            img = cached.convert("RGBA")
+    except Exception as e:
+        logger.warning(f"读取图片缓存失败 {cache_path}: {e}")
+        return None
+    _remember_image(key, img)
+    return img.copy()
+
+
+def _store_cached_image(url: str, size: tuple[int, int], img: Image.Image):
+    """写入内存与磁盘缓存"""
+    _remember_image((url, size), img)
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        img.save(_cache_path(url, size), "WEBP", quality=85)
+    except Exception as e:
+        logger.warning(f"写入图片缓存失败 {url}: {e}")
+
+
+def _remember_image(key: Tuple[str, Tuple[int, int]], img: Image.Image):
+    """放入内存LRU,超出容量时淘汰最久未用的条目"""
+    with _memory_cache_lock:
+        _memory_cache[key] = img
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > _MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def _decode_image(url: str, size: tuple[int, int], content: bytes) -> Image.Image:
+    """解码下载的图片、缩放到目标尺寸并写入缓存"""
+    img = Image.open(io.BytesIO(content))
+    # JPEG 按接近目标尺寸的比例直接缩小解码, 其他格式忽略
+    img.draft("RGB", size)
+    img = img.convert("RGBA").resize(size, Image.Resampling.BILINEAR)
+    _store_cached_image(url, size, img)
+    return img.copy()
+
+
+@lru_cache(maxsize=4)
+def _load_fonts(font_path: str) -> Tuple[ImageFont.FreeTypeFont, ImageFont.FreeTypeFont, ImageFont.FreeTypeFont]:
+    """加载标题、歌曲名、详情三种字号的字体,按路径缓存"""
+    try:
+        return (
+            ImageFont.truetype(font_path, 30),
+            ImageFont.truetype(font_path, 22),
+            ImageFont.truetype(font_path, 18),
+        )
+    except IOError:
+        logger.warning(f"字体文件'{font_path}'加载失败,使用默认字体")
+        return (
+            ImageFont.load_default(size=30),
+            ImageFont.load_default(size=22),
+            ImageFont.load_default(size=18),
+        )
+
+
+@lru_cache(maxsize=16)
+def _font_metrics(font: ImageFont.FreeTypeFont) -> Tuple[float, int]:
+    """返回字体的(单个汉字宽度, 行高)"""
+    ascent, descent = font.getmetrics()
+    return font.getlength("中"), ascent + descent
+
+
+@lru_cache(maxsize=1024)
+def _ink_height(text: str, font_path: str, font_index: int) -> int:
+    """测量(可多行)文字实际墨迹的高度,与在画布上调用 textbbox 的结果一致"""
+    font = _load_fonts(font_path)[font_index]
+    _, top, _, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text, font=font)
+    return int(bottom - top)
+
+
+def _wrap_cjk(text: str, width: int) -> str:
+    """按固定字数切分换行,中文没有空格,按词断行没有意义; 含空格的文本仍按词断行"""
+    if " " in text:
+        return textwrap.fill(text, width=width)
+    return "\n".join(text[i : i + width] for i in range(0, len(text), width))
+
+
+# 歌曲列表图片布局
+_IMG_WIDTH, _IMG_HEIGHT = 800, 800
+_MARGIN = 30
+_HEADER_HEIGHT = 80
+_TEXT_COLOR = (255, 255, 255, 255)
+
+# 已合成的列表模板(背景+标题+行底色+序号)
+_template_cache: TTLCache[Image.Image] = TTLCache(maxsize=4, ttl=3600)
+
+
+@lru_cache(maxsize=64)
+def _render_text_sprite(text: str, font_path: str, font_index: int) -> Image.Image:
+    """把一段文字预渲染为透明底的RGBA贴图,用于序号等重复出现的文字"""
+    font = _load_fonts(font_path)[font_index]
+    _, _, right, bottom = font.getbbox(text)
+    sprite = Image.new("RGBA", (max(int(right), 1), max(int(bottom), 1)), (0, 0, 0, 0))
+    ImageDraw.Draw(sprite).text((0, 0), text, font=font, fill=_TEXT_COLOR)
+    return sprite
+
+
+@lru_cache(maxsize=512)
+def _render_song_row(
+    name: str,
+    artist: str,
+    album: str,
+    song_id: int,
+    font_path: str,
+    row_width: int,
+) -> Image.Image:
+    """渲染单行歌曲的文字层(歌曲名、艺术家-专辑、ID),相同歌曲重复搜索时直接复用"""
+    _, font_item_name, font_item_detail = _load_fonts(font_path)
+    name_advance, _ = _font_metrics(font_item_name)
+    _, detail_line_height = _font_metrics(font_item_detail)
+    chars_per_line = int((row_width - 60 - 120) / name_advance)
+
+    # 歌曲名(自动换行), 艺术家行紧跟在歌曲名墨迹下方
+    wrapped_name = _wrap_cjk(name, min(chars_per_line, 25))
+    name_height = _ink_height(wrapped_name, font_path, 1)
+
+    # 艺术家和专辑
+    wrapped_artist_album = _wrap_cjk(f"{artist} - {album}", min(chars_per_line + 5, 30))
+    detail_lines = wrapped_artist_album.count("\n") + 1
+    detail_height = detail_lines * detail_line_height + (detail_lines - 1) * 4
+
+    row = Image.new("RGBA", (row_width, 8 + name_height + 5 + detail_height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(row)
+    draw.text((50, 8), wrapped_name, font=font_item_name, fill=_TEXT_COLOR)
+    draw.text((50, 8 + name_height + 5), wrapped_artist_album, font=font_item_detail, fill=_TEXT_COLOR)
+    draw.text((row_width - 100, 10), f"ID: {song_id}", font=font_item_detail, fill=_TEXT_COLOR)
+    return row
 
 
 async def download_image_as_pil(
@@ -17,33 +182,58 @@ async def download_image_as_pil(
     size: tuple[int, int],
     fallback_url: str,
     timeout: int = 15,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> Image.Image:
-    """下载图片并转换为PIL Image,支持fallback
+    """下载图片并转换为PIL Image,支持fallback和缓存
     
     Args:
         url: 图片URL
         size: 目标尺寸 (width, height)
         fallback_url: 备用URL
         timeout: 超时时间(秒)
+        client: HTTP客户端,默认使用共享客户端
         
     Returns:
         PIL Image对象
     """
-    for attempt_url in [url, fallback_url]:
-        try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.get(str(attempt_url))
-                response.raise_for_status()
-                img = Image.open(io.BytesIO(response.content)).convert("RGBA")
-                return img.resize(size)
-        except Exception as e:
-            logger.warning(f"下载图片失败 {attempt_url}: {e}")
+    img = await _fetch_image(url, size, fallback_url, timeout=timeout, client=client)
+    if img is not None:
+        return img
 
     # 最终fallback: 灰色背景
     logger.error("所有图片下载失败,使用纯色背景")
+    return _placeholder_image(size)
+
+
+def _placeholder_image(size: tuple[int, int]) -> Image.Image:
+    """图片全部下载失败时使用的灰色背景"""
     return Image.new("RGBA", size, (200, 200, 200, 255))
 
 
+async def _fetch_image(
+    url: str,
+    size: tuple[int, int],
+    fallback_url: str,
+    timeout: int = 15,
+    client: Optional[httpx.AsyncClient] = None,
+) -> Optional[Image.Image]:
+    """依次尝试url和fallback_url,全部失败时返回None"""
+    client = client or get_http_client()
+    for attempt_url in [url, fallback_url]:
+        attempt_url = str(attempt_url)
+        # 缓存读写和解码缩放都是阻塞操作, 放到线程中执行, 事件循环上只等待网络请求
+        cached = await asyncio.to_thread(_load_cached_image, attempt_url, size)
+        if cached is not None:
+            return cached
+        try:
+            response = await client.get(attempt_url, timeout=timeout)
+            response.raise_for_status()
+            return await asyncio.to_thread(_decode_image, attempt_url, size, response.content)
+        except Exception as e:
+            logger.warning(f"下载图片失败 {attempt_url}: {e}")
+    return None
+
+
 async def generate_song_list_image(
     songs: List[SongInfo],
     background_url: str,
@@ -51,8 +241,9 @@ async def generate_song_list_image(
     max_results: int,
     default_cover_url: str,
     timeout: int = 15,
+    output_dir: Optional[Path] = IMAGE_OUTPUT_DIR,
 ) -> str:
-    """生成歌曲列表图片,返回base64编码
+    """生成歌曲列表图片,写入输出目录并返回文件路径
     
     Args:
         songs: 歌曲列表
@@ -61,34 +252,72 @@ async def generate_song_list_image(
         max_results: 最大显示数量
         default_cover_url: 默认封面URL
         timeout: HTTP超时时间
+        output_dir: 图片输出目录,为None时返回base64编码
         
     Returns:
-        base64编码的PNG图片
+        WebP图片文件路径,未指定输出目录时为base64编码的WebP图片
     """
-    img_width, img_height = 800, 800
-    margin = 30
-    header_height = 80
-    song_item_height = (img_height - header_height - margin * 2) // max_results
-
-    # 加载背景
-    background_img = await download_image_as_pil(
-        background_url,
-        (img_width, img_height),
-        default_cover_url,
-        timeout=timeout,
-    )
+    row_count = min(len(songs), max_results)
+
+    # 背景、标题、行底色和序号与搜索内容无关, 合成好的模板按参数缓存
+    template_key = (background_url, default_cover_url, font_path, max_results, row_count)
+    template = _template_cache.get(template_key)
+    if template is None:
+        # 下载背景(IO), 其余PIL绘制与编码是纯CPU操作, 放到线程中执行避免阻塞事件循环
+        background_img = await _fetch_image(
+            background_url,
+            (_IMG_WIDTH, _IMG_HEIGHT),
+            default_cover_url,
+            timeout=timeout,
+        )
+        downloaded = background_img is not None
+        if background_img is None:
+            logger.error("背景图片下载失败,使用纯色背景")
+            background_img = _placeholder_image((_IMG_WIDTH, _IMG_HEIGHT))
+        template = await asyncio.to_thread(_render_template, background_img, font_path, max_results, row_count)
+        # 灰色占位的模板不缓存, 下次搜索重新下载背景
+        if downloaded:
+            _template_cache.set(template_key, template)
+
+    image_data = await asyncio.to_thread(_render_song_list, template, songs, font_path, max_results)
+    if output_dir is None:
+        return base64.b64encode(image_data).decode("utf-8")
+    return await asyncio.to_thread(_write_output_image, output_dir, image_data)
+
+
+def clear_template_cache():
+    """清空已合成的列表模板"""
+    _template_cache.clear()
+
+
+def _write_output_image(output_dir: Path, image_data: bytes) -> str:
+    """写入输出目录并顺带清理10分钟前生成的图片"""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    remove_expired_files(output_dir, 600)
+    file_path = output_dir / f"{uuid.uuid4().hex}.webp"
+    file_path.write_bytes(image_data)
+    return str(file_path)
+
+
+def _row_top(index: int, max_results: int) -> Tuple[int, int]:
+    """返回第index行的(顶部y坐标, 行高)"""
+    song_item_height = (_IMG_HEIGHT - _HEADER_HEIGHT - _MARGIN * 2) // max_results
+    return _HEADER_HEIGHT + _MARGIN + index * song_item_height, song_item_height
+
+
+def _render_template(
+    background_img: Image.Image,
+    font_path: str,
+    max_results: int,
+    row_count: int,
+) -> Image.Image:
+    """在背景图上绘制标题、各行半透明底色和序号"""
+    img_width = _IMG_WIDTH
+    margin = _MARGIN
     draw = ImageDraw.Draw(background_img)
 
     # 加载字体
-    try:
-        font_title = ImageFont.truetype(font_path, 30)
-        font_item_name = ImageFont.truetype(font_path, 22)
-        font_item_detail = ImageFont.truetype(font_path, 18)
-    except IOError:
-        logger.warning(f"字体文件'{font_path}'加载失败,使用默认字体")
-        font_title = ImageFont.load_default(size=30)
-        font_item_name = ImageFont.load_default(size=22)
-        font_item_detail = ImageFont.load_default(size=18)
+    font_title = _load_fonts(font_path)[0]
 
     # 绘制标题
     header_text = "网易云音乐搜索结果"
@@ -103,13 +332,8 @@ async def generate_song_list_image(
         stroke_width=2,
     )
 
-    # 绘制歌曲列表
-    current_y = header_height + margin
-    text_color = (255, 255, 255, 255)
-
-    for i, song in enumerate(songs[:max_results]):
-        if current_y + song_item_height > img_height - margin:
-            break
+    for i in range(row_count):
+        current_y, song_item_height = _row_top(i, max_results)
 
         # 半透明背景
         draw.rectangle(
@@ -118,48 +342,31 @@ async def generate_song_list_image(
         )
 
         # 序号
-        draw.text(
-            (margin + 10, current_y + 8),
-            f"{i+1}.",
-            font=font_item_name,
-            fill=text_color,
-        )
+        background_img.alpha_composite(_render_text_sprite(f"{i+1}.", font_path, 1), (margin + 10, current_y + 8))
 
-        # 歌曲名(自动换行)
-        available_width = img_width - margin * 2 - 60 - 120
-        chars_per_line = int(available_width / 20)
-        wrapped_name = textwrap.fill(song.name, width=min(chars_per_line, 25))
-        bbox_name = draw.textbbox((0, 0), wrapped_name, font=font_item_name)
-        name_height = bbox_name[3] - bbox_name[1]
-        draw.text(
-            (margin + 50, current_y + 8),
-            wrapped_name,
-            font=font_item_name,
-            fill=text_color,
-        )
+    return background_img
 
-        # 艺术家和专辑
-        artist_album_text = f"{song.artist} - {song.album}"
-        wrapped_artist_album = textwrap.fill(artist_album_text, width=min(chars_per_line + 5, 30))
-        draw.text(
-            (margin + 50, current_y + 8 + name_height + 5),
-            wrapped_artist_album,
-            font=font_item_detail,
-            fill=text_color,
-        )
 
-        # 歌曲ID
-        draw.text(
-            (img_width - margin - 100, current_y + 10),
-            f"ID: {song.id}",
-            font=font_item_detail,
-            fill=text_color,
-        )
+def _render_song_list(
+    template: Image.Image,
+    songs: List[SongInfo],
+    font_path: str,
+    max_results: int,
+) -> bytes:
+    """在模板上绘制歌曲文字并编码为WebP"""
+    background_img = template.copy()
+    row_width = _IMG_WIDTH - _MARGIN * 2
+    shown_songs = songs[:max_results]
 
-        current_y += song_item_height
+    # 每行文字是缓存的贴图, 只需一次合成; 除最后一行外裁到行高, 与逐行覆盖绘制的效果一致
+    for i, song in enumerate(shown_songs):
+        current_y, song_item_height = _row_top(i, max_results)
+        row = _render_song_row(song.name, song.artist, song.album, song.id, font_path, row_width)
+        if i < len(shown_songs) - 1:
+            background_img.alpha_composite(row, (_MARGIN, current_y), (0, 0, row_width, min(row.height, song_item_height)))
+        else:
+            background_img.alpha_composite(row, (_MARGIN, current_y))
 
-    # 转换为base64
     buffered = io.BytesIO()
-    background_img.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
-
+    background_img.save(buffered, format="WEBP", quality=85, method=4)
+    return buffered.getvalue()
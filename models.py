@@ -1,12 +1,21 @@
 """数据模型定义"""
 
-from typing import Literal
+from types import MappingProxyType
+from typing import Any, Dict, Literal, Mapping
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+# 缺省值共用的只读空字典, 避免每首歌都新建一个
+_EMPTY_DICT: Mapping[str, Any] = MappingProxyType({})
+
+# 搜索结果封面缩略图尺寸参数
+_COVER_SUFFIX = "?param=140y140"
 
 
 class SongInfo(BaseModel):
-    """单首歌曲的信息模型"""
+    """单首歌曲的信息模型(不可变,可哈希)"""
+
+    model_config = ConfigDict(frozen=True)
 
     id: int = Field(..., description="歌曲ID")
     name: str = Field(..., description="歌曲名称")
@@ -15,6 +24,25 @@ class SongInfo(BaseModel):
     duration: int = Field(..., description="时长(毫秒)")
     cover_url: str = Field(..., description="封面URL")
 
+    @classmethod
+    def from_ncm_row(cls, s: Dict[str, Any], default_cover_url: str) -> "SongInfo":
+        """从网易云搜索结果的单条歌曲数据构造
+
+        数据来自网易云接口, 跳过pydantic校验直接构造; 缺少 id/name 时抛出 KeyError
+        """
+        al = s.get("al") or _EMPTY_DICT
+        cover_url_raw = al.get("picUrl")
+        cover_url = (cover_url_raw + _COVER_SUFFIX) if cover_url_raw else default_cover_url
+
+        return cls.model_construct(
+            id=s["id"],
+            name=s["name"],
+            artist=", ".join(ar["name"] for ar in s.get("ar", ())),
+            album=al.get("name", "未知专辑"),
+            duration=s.get("dt", 0),
+            cover_url=cover_url,
+        )
+
 
 class PlaySongResponseCard(BaseModel):
     """播放歌曲响应卡片"""
@@ -27,3 +55,9 @@ class PlaySongResponseCard(BaseModel):
     audio_url: str = Field(..., description="音频URL")
     message: str = Field(..., description="附加信息")
 
+
+class CardApiResponse(BaseModel):
+    """签名卡片API响应"""
+
+    code: int = Field(..., description="状态码,1表示成功")
+    message: str = Field(..., description="成功时为JSON卡片数据,失败时为错误信息")
@@ -1,48 +1,103 @@
 """网易云音乐 API 封装"""
 
-from typing import TYPE_CHECKING, Any, Dict, List, Optional
+import asyncio
+import importlib
+import re
+import threading
+from functools import cache, lru_cache
+from itertools import islice
+from types import MappingProxyType
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+)
 
 from nekro_agent.api.plugin import dynamic_import_pkg
 from nekro_agent.core import logger
 
 from .models import SongInfo
+from .utils import TTLCache
 
 # 类型检查时导入
 if TYPE_CHECKING:
-    import pyncm
-    from pyncm import GetCurrentSession, Session, SetCurrentSession
-    from pyncm.apis import cloudsearch, track
+    from pyncm import Session
 
-# 运行时动态导入
-pyncm = dynamic_import_pkg("pyncm==1.8.1", import_name="pyncm")
 
-# 导入后需要显式导入子模块
-from pyncm import GetCurrentSession, Session, SetCurrentSession
-from pyncm.apis import cloudsearch, track
+class _SessionState:
+    """会话管理状态"""
 
-# 会话管理状态
-_session_state = {
-    "initialized": False,
-    "last_cookie": None,
-}
+    __slots__ = (
+        "detail_normalizer",
+        "empty_session",
+        "initialized",
+        "last_cookie_hash",
+        "last_cookie_len",
+    )
 
+    def __init__(self):
+        self.initialized: bool = False
+        self.last_cookie_hash: Optional[int] = None
+        self.last_cookie_len: Optional[int] = None
+        self.detail_normalizer: Optional[Callable[[Any], Dict[str, Any]]] = None
+        # 清理时替换进去的空会话, 只创建一次
+        self.empty_session: Optional["Session"] = None
 
-def parse_cookie_string(cookie_string: str) -> Dict[str, str]:
-    """解析Cookie字符串为字典"""
-    cookies = {}
+
+_session_state = _SessionState()
+_session_lock = threading.Lock()
+
+# Cookie 分隔符: 分号、换行(兼容\r\n)
+_COOKIE_SEP = re.compile(r"[;\r\n]")
+
+# 登录所需的 Cookie 字段
+_REQUIRED_COOKIE_KEYS = frozenset({"MUSIC_U", "__csrf"})
+
+# 搜索结果缓存 10 分钟; 歌曲元数据基本不变, 缓存 1 小时
+_search_cache: TTLCache[Tuple[SongInfo, ...]] = TTLCache(maxsize=256, ttl=600)
+_detail_cache: TTLCache[Dict[str, Any]] = TTLCache(maxsize=256, ttl=3600)
+
+
+@cache
+def _get_pyncm():
+    """首次使用时才动态导入 pyncm,避免拖慢插件加载"""
+    pyncm = dynamic_import_pkg("pyncm==1.8.1", import_name="pyncm")
+
+    # 导入后需要显式导入子模块
+    importlib.import_module("pyncm.apis.cloudsearch")
+    importlib.import_module("pyncm.apis.track")
+
+    return pyncm
+
+
+@lru_cache(maxsize=4)
+def parse_cookie_string(cookie_string: str) -> Mapping[str, str]:
+    """解析Cookie字符串为只读字典(结果按输入缓存)"""
+    cookies: Dict[str, str] = {}
     if not cookie_string or not cookie_string.strip():
-        return cookies
+        return MappingProxyType(cookies)
+
+    for item in _COOKIE_SEP.split(cookie_string):
+        i = item.find("=")
+        if i < 0:
+            continue
+        cookies[item[:i].strip()] = item[i + 1 :].strip()
 
-    # 支持多种分隔符: 分号、换行
-    cookie_string = cookie_string.replace("\n", "; ").replace("\r", "")
+    return MappingProxyType(cookies)
 
-    for item in cookie_string.split(";"):
-        item = item.strip()
-        if "=" in item:
-            key, _, value = item.partition("=")
-            cookies[key.strip()] = value.strip()
 
-    return cookies
+def _is_session_current(cookie_hash: int, cookie_len: int) -> bool:
+    """会话是否已按相同的 Cookie 初始化"""
+    return (
+        _session_state.initialized
+        and _session_state.last_cookie_len == cookie_len
+        and _session_state.last_cookie_hash == cookie_hash
+    )
 
 
 def ensure_session_initialized(cookie_string: str) -> Optional[str]:
@@ -56,38 +111,63 @@ def ensure_session_initialized(cookie_string: str) -> Optional[str]:
     """
     # 检查 Cookie 是否为空
     if not cookie_string or not cookie_string.strip():
-        _session_state["initialized"] = False
+        _session_state.initialized = False
         return "未配置网易云音乐Cookie，请在插件配置中填写完整的Cookie字符串"
     
-    # 检查配置是否变更
-    if _session_state["initialized"] and _session_state["last_cookie"] == cookie_string:
+    # 检查配置是否变更: 只比较长度和哈希(字符串哈希会缓存在对象上), 不逐字节比较Cookie
+    cookie_hash = hash(cookie_string)
+    cookie_len = len(cookie_string)
+    if _is_session_current(cookie_hash, cookie_len):
         # 配置未变更，无需重新初始化
         return None
-    
-    # 解析 Cookie 字符串
-    cookies_dict = parse_cookie_string(cookie_string)
-    
-    # 验证必需字段
-    required_keys = ["MUSIC_U", "__csrf"]
-    missing_keys = [k for k in required_keys if k not in cookies_dict]
-    if missing_keys:
-        _session_state["initialized"] = False
-        return f"Cookie字符串缺少必需字段: {', '.join(missing_keys)}。请确保Cookie包含 MUSIC_U 和 __csrf 字段"
-    
-    # 创建并设置 Session
-    session = Session()
-    for key, value in cookies_dict.items():
-        session.cookies.set(key, value)
-    SetCurrentSession(session)
-    
-    # 更新状态
-    _session_state["initialized"] = True
-    _session_state["last_cookie"] = cookie_string
-    logger.info("pyncm会话初始化成功")
-    
+
+    # 并发调用时只允许一个调用方重建会话, 拿到锁后再检查一次
+    with _session_lock:
+        if _is_session_current(cookie_hash, cookie_len):
+            return None
+
+        # 解析 Cookie 字符串
+        cookies_dict = parse_cookie_string(cookie_string)
+
+        # 验证必需字段
+        missing_keys = _REQUIRED_COOKIE_KEYS - cookies_dict.keys()
+        if missing_keys:
+            _session_state.initialized = False
+            return f"Cookie字符串缺少必需字段: {', '.join(sorted(missing_keys))}。请确保Cookie包含 MUSIC_U 和 __csrf 字段"
+
+        # 创建并设置 Session
+        pyncm = _get_pyncm()
+        session = pyncm.Session()
+        for key, value in cookies_dict.items():
+            session.cookies.set(key, value)
+
+        # pyncm 的 Session 继承自 requests.Session, 放大连接池以便线程中的并发请求复用连接
+        from requests.adapters import HTTPAdapter
+
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        pyncm.SetCurrentSession(session)
+
+        # 更新状态, initialized 最后置位, 保证无锁快速路径读到的是完整状态
+        _session_state.last_cookie_hash = cookie_hash
+        _session_state.last_cookie_len = cookie_len
+        _session_state.initialized = True
+        logger.info("pyncm会话初始化成功")
+
     return None
 
 
+def _safe_from_ncm(s: Dict[str, Any], default_cover_url: str) -> Optional[SongInfo]:
+    """构造SongInfo,数据格式异常时记录日志并返回None"""
+    try:
+        return SongInfo.from_ncm_row(s, default_cover_url)
+    except Exception as e:
+        # 参数交给 logger 延迟格式化, 日志级别被过滤时不拼接字符串
+        logger.warning("处理歌曲 {} 失败: {}", s.get("name", "Unknown"), e)
+        return None
+
+
 def search_songs_from_ncm(
     keyword: str,
     max_results: int,
@@ -106,7 +186,13 @@ def search_songs_from_ncm(
     Raises:
         ValueError: 搜索无结果
     """
+    cache_key = (keyword.strip().lower(), max_results, default_cover_url)
+    cached = _search_cache.get(cache_key)
+    if cached is not None:
+        return list(cached)
+
     # 调用pyncm API搜索
+    cloudsearch = _get_pyncm().apis.cloudsearch
     search_result = cloudsearch.GetSearchResult(keyword, stype=cloudsearch.SONG)
 
     # pyncm API返回的是dict
@@ -116,34 +202,84 @@ def search_songs_from_ncm(
     if not songs_data:
         raise ValueError(f"未找到与'{keyword}'相关的歌曲")
 
-    # 处理歌曲数据
-    song_infos: List[SongInfo] = []
-    for s in songs_data[:max_results]:
-        try:
-            cover_url_raw = s.get("al", {}).get("picUrl")
-            cover_url = f"{cover_url_raw}?param=140y140" if cover_url_raw else default_cover_url
-
-            song_infos.append(
-                SongInfo(
-                    id=s["id"],
-                    name=s["name"],
-                    artist=", ".join([ar["name"] for ar in s.get("ar", [])]),
-                    album=s.get("al", {}).get("name", "未知专辑"),
-                    duration=s.get("dt", 0),
-                    cover_url=cover_url,
-                ),
-            )
-        except Exception as e:
-            # 跳过格式异常的歌曲数据
-            logger.warning(f"处理歌曲 {s.get('name', 'Unknown')} 失败: {e}")
-            continue
+    # 处理歌曲数据, 跳过格式异常的条目
+    song_infos = [
+        info for s in islice(songs_data, max_results) if (info := _safe_from_ncm(s, default_cover_url)) is not None
+    ]
 
     if not song_infos:
         raise ValueError(f"未能解析'{keyword}'的搜索结果")
 
+    _search_cache.set(cache_key, tuple(song_infos))
     return song_infos
 
 
+def _track_details_from_dict(result: Any) -> Dict[str, Any]:
+    """dict 形式的返回值即为响应数据"""
+    return result
+
+
+def _track_details_from_tuple(result: Any) -> Dict[str, Any]:
+    """tuple 形式的第二个元素才是响应数据, 出错时接口可能直接返回 dict"""
+    return result[1] if isinstance(result, tuple) else result
+
+
+def _normalize_track_details(result: Any) -> Dict[str, Any]:
+    """统一 pyncm GetTrackDetail 的返回值
+
+    pyncm 返回的类型随版本不同(dict 或 tuple), 但对已安装的版本是固定的,
+    首次调用时判断一次形态并记住对应的处理函数
+    """
+    normalizer = _session_state.detail_normalizer
+    if normalizer is None:
+        if isinstance(result, dict):
+            normalizer = _track_details_from_dict
+        elif isinstance(result, tuple):
+            normalizer = _track_details_from_tuple
+        else:
+            return {}
+        _session_state.detail_normalizer = normalizer
+    return normalizer(result)
+
+
+def get_song_details(song_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """批量获取歌曲详情,未缓存的ID合并为一次请求
+    
+    Args:
+        song_ids: 歌曲ID列表
+        
+    Returns:
+        以歌曲ID为键的详情字典,不存在的歌曲不会出现在结果中
+    """
+    details: Dict[int, Dict[str, Any]] = {}
+    missing_ids: List[int] = []
+    for song_id in song_ids:
+        cached = _detail_cache.get(song_id)
+        if cached is not None:
+            details[song_id] = cached
+        elif song_id not in missing_ids:
+            missing_ids.append(song_id)
+
+    if not missing_ids:
+        return details
+
+    track_details = _normalize_track_details(_get_pyncm().apis.track.GetTrackDetail(missing_ids))
+    # tuple 的第二个元素也可能不是 dict(如请求失败), 此时按未找到处理
+    if not isinstance(track_details, dict):
+        return details
+
+    songs = track_details.get("songs", [])
+    if not isinstance(songs, list):
+        return details
+
+    for song_detail in songs:
+        if isinstance(song_detail, dict) and "id" in song_detail:
+            _detail_cache.set(song_detail["id"], song_detail)
+            details[song_detail["id"]] = song_detail
+
+    return details
+
+
 def get_song_detail(song_id: int) -> Dict[str, Any]:
     """获取歌曲详情
     
@@ -156,30 +292,38 @@ def get_song_detail(song_id: int) -> Dict[str, Any]:
     Raises:
         ValueError: 歌曲不存在
     """
-    track_details_result = track.GetTrackDetail([song_id])
-    # pyncm 返回的类型不固定，这里做类型断言
-    if isinstance(track_details_result, dict):
-        track_details = track_details_result
-    else:
-        # 如果是 tuple，取第二个元素
-        track_details = track_details_result[1] if isinstance(track_details_result, tuple) else {}
-
-    if not isinstance(track_details, dict) or not track_details.get("songs"):
+    song_detail = get_song_details([song_id]).get(song_id)
+    if song_detail is None:
         raise ValueError(f"未找到歌曲ID {song_id}")
+    return song_detail
+
+
+async def asearch_songs_from_ncm(
+    keyword: str,
+    max_results: int,
+    default_cover_url: str,
+) -> List[SongInfo]:
+    """search_songs_from_ncm 的异步版本,阻塞的 pyncm 请求在线程中执行"""
+    return await asyncio.to_thread(search_songs_from_ncm, keyword, max_results, default_cover_url)
 
-    songs = track_details.get("songs", [])
-    if not isinstance(songs, list) or len(songs) == 0:
-        raise ValueError(f"未找到歌曲ID {song_id}")
 
-    return songs[0]  # type: ignore
+async def aget_song_detail(song_id: int) -> Dict[str, Any]:
+    """get_song_detail 的异步版本,阻塞的 pyncm 请求在线程中执行"""
+    return await asyncio.to_thread(get_song_detail, song_id)
 
 
 def cleanup_pyncm_session():
     """清理pyncm会话"""
-    if _session_state["initialized"]:
-        empty_session = Session()
-        SetCurrentSession(empty_session)
-        _session_state["initialized"] = False
-        _session_state["last_cookie"] = None
-        logger.info("pyncm会话已清理")
+    with _session_lock:
+        if _session_state.initialized:
+            pyncm = _get_pyncm()
+            if _session_state.empty_session is None:
+                _session_state.empty_session = pyncm.Session()
+            pyncm.SetCurrentSession(_session_state.empty_session)
+            _session_state.initialized = False
+            _session_state.last_cookie_hash = None
+            _session_state.last_cookie_len = None
+            logger.info("pyncm会话已清理")
+    _search_cache.clear()
+    _detail_cache.clear()
 
@@ -1,10 +1,68 @@
 """工具函数模块"""
 
-from typing import Tuple
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
 
 from nekro_agent.core import logger
 
+T = TypeVar("T")
 
+# 插件临时文件目录
+TEMP_DIR = Path(tempfile.gettempdir()) / "nekro_cloudmusic_search"
+IMAGE_OUTPUT_DIR = TEMP_DIR / "output"
+
+# chat_key 格式: onebot_v11-group_123456 或 onebot_v11-private_123456
+_CHAT_KEY_RE = re.compile(r"[^-]*-(group|private)_(\d+)")
+
+
+class TTLCache(Generic[T]):
+    """带过期时间的LRU缓存(线程安全)
+    
+    Args:
+        maxsize: 最大条目数,超出时淘汰最久未使用的条目
+        ttl: 条目存活时间(秒)
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, T]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        """读取缓存,未命中或已过期返回None"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            ts, value = entry
+            if time.monotonic() - ts >= self.ttl:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: T):
+        """写入缓存"""
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._data.clear()
+
+
+@lru_cache(maxsize=1024)
 def parse_chat_key(chat_key: str) -> Tuple[str, int]:
     """解析chat_key提取聊天类型和ID
     
@@ -19,27 +77,12 @@ def parse_chat_key(chat_key: str) -> Tuple[str, int]:
     """
     if not chat_key:
         raise ValueError("chat_key不能为空")
-    
-    # 格式: onebot_v11-group_123456 或 onebot_v11-private_123456
-    if "-" not in chat_key:
-        raise ValueError(f"chat_key格式错误，缺少'-'分隔符: {chat_key}")
-    
-    # 第一次分割: ["onebot_v11", "group_123456"]
-    _, chat_part = chat_key.split("-", 1)
-    
-    # 第二次分割: ["group", "123456"]
-    if "_" not in chat_part:
-        raise ValueError(f"chat_key格式错误，缺少'_'分隔符: {chat_key}")
-    
-    chat_type, target_id_str = chat_part.split("_", 1)
-    
-    if chat_type not in ("group", "private"):
-        raise ValueError(f"不支持的聊天类型: {chat_type}")
-    
-    if not target_id_str.isdigit():
-        raise ValueError(f"无效的目标ID: {target_id_str}")
-    
-    return chat_type, int(target_id_str)
+
+    m = _CHAT_KEY_RE.fullmatch(chat_key)
+    if not m:
+        raise ValueError(f"chat_key格式错误: {chat_key}")
+
+    return m.group(1), int(m.group(2))
 
 
 def format_duration(milliseconds: int) -> str:
@@ -51,11 +94,31 @@ def format_duration(milliseconds: int) -> str:
     Returns:
         格式化的时长字符串，如 "3:45" 或 "1:23:45"
     """
-    seconds = milliseconds // 1000
-    hours = seconds // 3600
-    minutes = (seconds % 3600) // 60
-    secs = seconds % 60
+    minutes, secs = divmod(milliseconds // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes}:{secs:02d}"
+
+
+def remove_expired_files(directory: Path, max_age: float) -> int:
+    """删除目录下修改时间早于max_age秒之前的文件
     
-    if hours > 0:
-        return f"{hours}:{minutes:02d}:{secs:02d}"
-    return f"{minutes}:{secs:02d}"
+    Args:
+        directory: 目标目录
+        max_age: 最长保留时间(秒),为0时删除全部文件
+        
+    Returns:
+        删除的文件数量
+    """
+    if not directory.is_dir():
+        return 0
+
+    deadline = time.time() - max_age
+    removed = 0
+    for path in directory.iterdir():
+        try:
+            if path.is_file() and path.stat().st_mtime <= deadline:
+                path.unlink()
+                removed += 1
+        except OSError as e:
+            logger.warning(f"删除过期文件失败 {path}: {e}")
+    return removed